@@ -1,6 +1,10 @@
+import os
 import sys
+import json
+from time import perf_counter
 from re import compile, match
-from collections import deque
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from abc import ABC, abstractmethod
 from datetime import datetime
 
@@ -76,6 +80,8 @@ class ReadFileWrapper:
                     raise StopIteration
         except StopIteration:
             self._end_reached = True
+            if self._current_item_first_line is None:  # there were no items at all
+                raise
             return self._wnr_current_item('')
 
         # while not self._end_reached:
@@ -166,6 +172,25 @@ class ParseResult(ABC):
     BACKSIDE_DEPTH = 4
     FILL_TO_TAG = 30
 
+    # card header lines already built, keyed by (depth, header text, whether it's
+    # a drill header); they are the same for every card so they are built only once
+    _header_lines = {}
+
+    @classmethod
+    def _header_line(cls, depth, header, drill=False):
+        """Returns the org header line of depth 'depth' for 'header', padded
+        and tagged with ':drill:' if 'drill' is True.
+        """
+        key = (depth, header, drill)
+        line = cls._header_lines.get(key)
+        if line is None:
+            line = depth * "*" + " " + header
+            if drill:
+                line = line.ljust(cls.FILL_TO_TAG) + ":drill:"
+            line += "\n"
+            cls._header_lines[key] = line
+        return line
+
     # TODO add __init__() that calls _set_header instead of calling it from subclasses?
     # _set_header() initializes flashcard_lines which doesn't belong in this method,
     # or rather it should belong in __init__()
@@ -178,6 +203,7 @@ class ParseResult(ABC):
         :return:
         """
         self.flashcard_lines = deque()
+        # not built with _header_line(), since the header is different for every item
         self.flashcard_lines.append(self.ROOT_DEPTH * "*" + " " + header + "\n")
 
     def _add_card(self, question, answer, qheader='q', aheader='a'):
@@ -187,10 +213,9 @@ class ParseResult(ABC):
         This should be called from within _create_flashcards within
         subclasses of ParseResult after text that goes into cards is parsed.
         """
-        self.flashcard_lines.append((self.FRONTSIDE_DEPTH * "*" + " " + qheader)
-                                    .ljust(self.FILL_TO_TAG) + ":drill:\n")
+        self.flashcard_lines.append(self._header_line(self.FRONTSIDE_DEPTH, qheader, True))
         self.flashcard_lines.append(question + "\n")
-        self.flashcard_lines.append(self.BACKSIDE_DEPTH * "*" + " " + aheader + "\n")
+        self.flashcard_lines.append(self._header_line(self.BACKSIDE_DEPTH, aheader))
         self.flashcard_lines.append(answer + "\n")
 
     @abstractmethod
@@ -313,6 +338,7 @@ class OldNoun(ParseResult):
     """
 
     def __init__(self, noun_dict):
+        self.noun_dict = noun_dict
         self._create_flashcards(noun_dict)
 
     def _create_flashcards(self, noun_dict):
@@ -347,6 +373,7 @@ class NewNoun(ParseResult):
     """
 
     def __init__(self, noun_dict):
+        self.noun_dict = noun_dict
         self._create_flashcards(noun_dict)
 
     def _create_flashcards(self, noun_dict):
@@ -377,27 +404,128 @@ class NewNoun(ParseResult):
         self._add_card("jednina od *" + plural + "*", singular)
 
 
+class KnownNoun(NewNoun):
+    """A class that knows how to create flashcards for a new noun whose item
+    gives only the noun itself (e.g. "- Holz"), with the rest of it (article,
+    plural, translation) completed from a Lexicon.
+
+    """
+
+
+class Lexicon:
+    """German nouns learned from parsed items, keyed by lemma (the noun
+    without article), each with its article, plural and translations.
+
+    The lexicon is saved as a compact tab-separated file, one noun per line,
+    and is kept in a dictionary when loaded, so lookups take constant time.
+    """
+
+    ARTICLES = ("der", "die", "das")
+
+    def __init__(self):
+        self._nouns = {}  # lemma -> (article, plural or '', list of translations)
+
+    def __len__(self):
+        return len(self._nouns)
+
+    def learn(self, noun_dict):
+        """Adds a noun as returned by parse_noun() to the lexicon.  Translations
+        of an already known noun are added to the ones it has.
+        """
+        (article, _, lemma) = noun_dict["singular"].partition(" ")
+        plural = noun_dict.get("plural") or ''
+        translation = noun_dict["translation"].strip()
+        known = self._nouns.get(lemma)
+        if known is None:
+            self._nouns[lemma] = (article.lower(), plural, [translation])
+            return
+        if translation not in known[2]:
+            known[2].append(translation)
+        self._nouns[lemma] = (article.lower(), plural or known[1], known[2])
+
+    def lookup(self, lemma):
+        """:return: noun dictionary in the format of parse_noun(), or None if
+        'lemma' is not known.
+        """
+        known = self._nouns.get(lemma)
+        if known is None:
+            return None
+        noun_dict = {"singular": known[0] + " " + lemma,
+                     "translation": ", ".join(known[2])}
+        if known[1]:
+            noun_dict["plural"] = known[1]
+        return noun_dict
+
+    @classmethod
+    def bare_noun(cls, item):
+        """Finds the noun of an item that gives only a noun, with or without
+        article (e.g. "- Holz" or "- das Holz"), without any regex parsing.
+
+        >>> Lexicon.bare_noun("- das Holz")
+        'Holz'
+        >>> Lexicon.bare_noun("- das Holz = drvo") is None
+        True
+
+        :return: the noun, or None if 'item' isn't such an item
+        """
+        words = item[2:].split()
+        if len(words) == 2 and words[0].lower() in cls.ARTICLES:
+            words = words[1:]
+        if len(words) != 1 or not words[0].isalpha():
+            return None
+        return words[0]
+
+    def complete(self, item):
+        """Looks up an item that gives only a noun (see bare_noun()).
+
+        :return: noun dictionary, or None if 'item' isn't such an item or the
+        noun is not known
+        """
+        lemma = self.bare_noun(item)
+        if lemma is None:
+            return None
+        return self.lookup(lemma)
+
+    def load(self, file_name):
+        """Adds the nouns saved by save() in file 'file_name' to the lexicon.
+        A missing file is treated as an empty lexicon.
+        """
+        try:
+            with open(file_name, 'r', encoding="utf-8") as f_lexicon:
+                for line in f_lexicon:
+                    (lemma, article, plural, *translations) = line.rstrip("\n").split("\t")
+                    self._nouns[lemma] = (article, plural, translations)
+        except FileNotFoundError:
+            return
+
+    def save(self, file_name):
+        """Writes the lexicon to file 'file_name', sorted by lemma."""
+        with open(file_name, 'w', encoding="utf-8") as f_lexicon:
+            for lemma in sorted(self._nouns):
+                (article, plural, translations) = self._nouns[lemma]
+                f_lexicon.write("\t".join([lemma, article, plural] + translations) + "\n")
+
+
 def fill_paragraph(paragraph, max_width=79):
     """"Takes a string (paragraph) and returns a paragraph filled to be a
     maximum width of 'width' characters long (more or less).  No trailing
     newlines.
 
     """
-    line = ''
     lines = []
+    line = []    # words of the line that is being filled
+    width = -1   # width of the words in 'line' with spaces between them
     for word in paragraph.split():
-        if len(line) != 0:
-            if len(line) + 1 + len(word) > max_width:
-                lines.append(line + "\n")
-                line = word
-            else:
-                line += ' ' + word
-        else:
-            line = word
-    if not lines:
-        return line
+        if line and width + 1 + len(word) > max_width:
+            lines.append(" ".join(line))
+            line = []
+            width = -1
+        line.append(word)
+        width += 1 + len(word)
+    if line:
+        lines.append(" ".join(line))
 
-    return "".join(lines).strip()
+    return "\n".join(lines)
 
 
 def parse_noun(item):
@@ -446,33 +574,400 @@ def parse_noun(item):
     raise ItemFormatError("Not a noun")
 
 
-def parse_item(item):
+def parse_item(item, lexicon=None):
     """Tries to extract an item's translation and possibly additional
     data and create flashcards.
 
+    :param lexicon: Lexicon that learns the parsed nouns and completes items
+    that give only a noun, or None
     :return: ParseResult object instance.
     """
 
+    if lexicon is not None:
+        noun_dict = lexicon.complete(item)
+        if noun_dict is not None:
+            return KnownNoun(noun_dict)
     try:
         if item.startswith("- (o) "):
-            return OldNoun(parse_noun("-" + item[5:]))
+            noun_dict = parse_noun("-" + item[5:])
+            if lexicon is not None:
+                lexicon.learn(noun_dict)
+            return OldNoun(noun_dict)
     except (ItemFormatError, IndexError):
         pass
     try:
-        return NewNoun(parse_noun(item))
+        noun_dict = parse_noun(item)
+        if lexicon is not None:
+            lexicon.learn(noun_dict)
+        return NewNoun(noun_dict)
     except ItemFormatError:
         pass
     return SimplePair(item)
     # TODO other formats
 
 
+class RenderCache:
+    """A least-recently-used cache of rendered flashcards, keyed by the
+    normalized text of the item they were created from.
+
+    Word lists repeat the same items across files and sessions, so an item that
+    was already rendered is not parsed again.  The cache can be saved to and
+    loaded from a file to be kept between runs.
+
+    If 'lexicon' is set, items are parsed with it (see parse_item()).  Items
+    completed from the lexicon are not cached, because the lexicon may change.
+    The nouns of cached items are kept with their flashcards, so the lexicon
+    learns them on cache hits too.
+    """
+
+    # written into saved caches; increase it whenever the rendering of
+    # flashcards changes, so that caches with stale flashcards are not used
+    VERSION = 2
+
+    def __init__(self, maxsize=4096, lexicon=None):
+        self.maxsize = maxsize
+        self.lexicon = lexicon
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (lines, noun dictionary or None)
+        self._touched = None  # keys used since take_touched(), if tracked
+
+    def render(self, item):
+        """Returns the flashcard lines for 'item', either from cache or by
+        parsing it.  Items that can't be parsed are not cached.
+
+        :return: tuple of strings -- lines of the org-drill flashcards
+        :raises ItemFormatError: if 'item' can't be parsed
+        """
+        key = " ".join(item.split())
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            self._touch(key)
+            (lines, noun_dict) = entry
+            if noun_dict is not None and self.lexicon is not None:
+                self.lexicon.learn(noun_dict)
+            return lines
+
+        self.misses += 1
+        result = parse_item(key, self.lexicon)
+        lines = tuple(result.flashcard_lines)
+        if isinstance(result, KnownNoun):
+            return lines
+        self._entries[key] = (lines, getattr(result, "noun_dict", None))
+        self._touch(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return lines
+
+    def load(self, file_name):
+        """Adds the entries saved by save() in file 'file_name' to the cache.
+        A missing file, or one saved by a different VERSION, is treated as an
+        empty cache.
+        """
+        try:
+            with open(file_name, 'r', encoding="utf-8") as f_cache:
+                saved = json.load(f_cache)
+        except FileNotFoundError:
+            return
+        if not isinstance(saved, dict) or saved.get("version") != self.VERSION:
+            return
+        for key, lines, noun_dict in saved["entries"]:
+            self._entries[key] = (tuple(lines), noun_dict)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def save(self, file_name):
+        """Writes the entries to file 'file_name', least recently used first."""
+        with open(file_name, 'w', encoding="utf-8") as f_cache:
+            json.dump({"version": self.VERSION,
+                       "entries": [(key, lines, noun_dict) for key, (lines, noun_dict)
+                                   in self._entries.items()]},
+                      f_cache, ensure_ascii=False)
+
+    def _touch(self, key):
+        if self._touched is not None:
+            self._touched[key] = None
+            self._touched.move_to_end(key)
+
+    def track_touched(self):
+        """Starts keeping track of the entries that are used, for take_touched()."""
+        self._touched = OrderedDict()
+
+    def take_touched(self):
+        """Returns a RenderCache with only the entries used (hit or rendered)
+        since the last call, in the order of their last use, and the counters
+        since then.  The counters of this cache are reset.
+        """
+        touched = RenderCache(self.maxsize)
+        for key in self._touched:
+            if key in self._entries:
+                touched._entries[key] = self._entries[key]
+        touched.hits = self.hits
+        touched.misses = self.misses
+        self.hits = 0
+        self.misses = 0
+        self._touched = OrderedDict()
+        return touched
+
+    def update(self, other):
+        """Adds the entries and counters of RenderCache 'other' to this cache,
+        as the most recently used ones."""
+        self.hits += other.hits
+        self.misses += other.misses
+        for key, entry in other._entries.items():
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# 'read_error' is the message of the error that prevented reading the file, or None
+FileSummary = namedtuple("FileSummary", ('name', 'items', 'cards', 'errors', 'seconds',
+                                         'read_error'))
+
+
+def _report_bad_item(f_read_name, line_counter, ex):
+    # TODO BETTER LOGGING
+    sys.stderr.write(f_read_name + ": bad item format around line "
+                     + str(line_counter)
+                     + ", message = "
+                     + ex.message
+                     + "\n")
+
+
+def _count_cards(lines):
+    return sum(1 for line in lines if line.endswith(":drill:\n"))
+
+
+def parse_file(f_read_name, cache, deferred=None):
+    """Parses all the items of file 'f_read_name' into flashcards.
+
+    :param cache: RenderCache to render the items with
+    :param deferred: list or None; if a list, the items that give only a noun
+    (see Lexicon.bare_noun()) are not rendered, but None is put in their place
+    among the flashcard lines and (item, line number, number of nouns learned
+    so far by cache.lexicon) is appended to the list (see _LearnedNouns)
+    :return: (deque of flashcard lines, FileSummary, cache)
+    """
+    start = perf_counter()
+    items = 0
+    cards = 0
+    errors = 0
+    flashcards = deque()
+    with ReadFileWrapper(open(f_read_name, 'r', encoding="utf-8")) as fwrap:
+        for item in fwrap:
+            items += 1
+            if deferred is not None and Lexicon.bare_noun(item) is not None:
+                deferred.append((item, fwrap.line_counter, len(cache.lexicon.nouns)))
+                flashcards.append(None)
+                continue
+            try:
+                lines = cache.render(item)
+            except ItemFormatError as ex:
+                errors += 1
+                _report_bad_item(f_read_name, fwrap.line_counter, ex)
+                continue
+            flashcards.extend(lines)
+            cards += _count_cards(lines)
+    summary = FileSummary(f_read_name, items, cards, errors, perf_counter() - start, None)
+    return flashcards, summary, cache
+
+
+def batch_read_names(names):
+    """Expands directories within 'names' into the .org files they contain,
+    sorted by name, so that the order of files is always the same.
+    """
+    f_read_names = []
+    for name in names:
+        if os.path.isdir(name):
+            f_read_names.extend(sorted(os.path.join(name, f_name) for f_name in os.listdir(name)
+                                       if f_name.endswith(".org")))
+        else:
+            f_read_names.append(name)
+    return f_read_names
+
+
+class _LearnedNouns:
+    """Takes the place of the Lexicon in a batch worker.  Workers parse files
+    in no particular order, so they don't complete any items; the nouns they
+    learn are only recorded, in order, to be learned by the parent process
+    file after file (see _complete_deferred()).
+    """
+
+    def __init__(self):
+        self.nouns = []
+
+    def learn(self, noun_dict):
+        self.nouns.append(noun_dict)
+
+    def complete(self, item):
+        return None
+
+
+# the RenderCache of a batch worker process, set by _init_batch_worker()
+_worker_cache = None
+
+
+def _init_batch_worker(cache):
+    global _worker_cache
+    _worker_cache = cache
+    _worker_cache.track_touched()
+    if cache.lexicon is not None:
+        _worker_cache.lexicon = _LearnedNouns()
+
+
+def _parse_file_in_worker(f_read_name):
+    """Like parse_file(), with the worker's cache, but only the entries used for
+    this file are returned, so the whole cache isn't sent back for every file.
+    A file that can't be read is reported in its summary instead of stopping
+    the whole batch, and no flashcards are returned for it.  With a lexicon,
+    items that give only a noun are deferred (see parse_file()).
+
+    :return: (flashcard lines, FileSummary, RenderCache of the used entries,
+    learned nouns, deferred items)
+    """
+    lexicon = _worker_cache.lexicon
+    deferred = None
+    if lexicon is not None:
+        lexicon.nouns = []
+        deferred = []
+    try:
+        (flashcards, summary, _) = parse_file(f_read_name, _worker_cache, deferred)
+    except (OSError, UnicodeDecodeError) as ex:
+        (flashcards, summary) = (None, FileSummary(f_read_name, 0, 0, 0, 0.0, str(ex)))
+        if lexicon is not None:
+            lexicon.nouns = []
+    nouns = lexicon.nouns if lexicon is not None else []
+    return flashcards, summary, _worker_cache.take_touched(), nouns, deferred
+
+
+def _complete_deferred(flashcards, summary, nouns, deferred, cache):
+    """Learns the nouns a batch worker recorded for a file and renders the
+    items it deferred, in the order they are in the file, so that items are
+    completed by the lexicon of 'cache' just as if the files were parsed one
+    after another.
+
+    :return: (list of flashcard lines, FileSummary)
+    """
+    lines = []
+    cards = summary.cards
+    errors = summary.errors
+    learned = 0
+    deferred = iter(deferred)
+    for entry in flashcards:
+        if entry is not None:
+            lines.append(entry)
+            continue
+        (item, line_counter, known) = next(deferred)
+        for noun_dict in nouns[learned:known]:
+            cache.lexicon.learn(noun_dict)
+        learned = known
+        try:
+            item_lines = cache.render(item)
+        except ItemFormatError as ex:
+            errors += 1
+            _report_bad_item(summary.name, line_counter, ex)
+            continue
+        lines.extend(item_lines)
+        cards += _count_cards(item_lines)
+    for noun_dict in nouns[learned:]:
+        cache.lexicon.learn(noun_dict)
+    return lines, summary._replace(cards=cards, errors=errors)
+
+
+def parse_batch(f_read_names, f_write_name, cache):
+    """Parses many files in parallel processes and appends all their flashcards
+    to file 'f_write_name', under a header per file, in the order of 'f_read_names'.
+
+    The lexicon of 'cache', if it has one, stays in this process: it learns the
+    nouns of the files and completes items in the order of the files, so the
+    flashcards are the same as when the files are parsed one by one.
+
+    :param cache: RenderCache that every process starts with (it is sent to
+    each process once); the entries the processes use are added back to it
+    :return: list of FileSummary, one per file; files that couldn't be read
+    have no header in 'f_write_name'
+    """
+    with ProcessPoolExecutor(initializer=_init_batch_worker,
+                             initargs=(cache,)) as executor:
+        results = list(executor.map(_parse_file_in_worker, f_read_names))
+    timestamp = str(datetime.now())
+    summaries = []
+    with open(f_write_name, 'a', encoding="utf-8") as f_write:
+        for flashcards, summary, file_cache, nouns, deferred in results:
+            cache.update(file_cache)
+            if summary.read_error is None and cache.lexicon is not None:
+                (flashcards, summary) = _complete_deferred(flashcards, summary,
+                                                           nouns, deferred, cache)
+            summaries.append(summary)
+            if summary.read_error is not None:
+                continue
+            f_write.write("* flashcards " + summary.name + " " + timestamp + "\n")
+            for entry in flashcards:
+                f_write.write(entry)
+    return summaries
+
+
 def __main__():
     """Parses 'german phrase'-translation pairs from the passed file
     (argument1), creates from them flashcards usable with org-drill in
     emacs org-mode and writes them into the other passed file
-    (argument2).
+    (argument2).  With '--batch', many files are parsed in parallel into one
+    file (see parse_batch()).
 
     """
+    # "--cache FILE" can be passed anywhere among the arguments
+    cache = RenderCache()
+    f_cache_name = None
+    if "--cache" in sys.argv:
+        i = sys.argv.index("--cache")
+        if i + 1 == len(sys.argv):
+            sys.exit("'--cache' expects the name of the cache file.")
+        f_cache_name = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+        cache.load(f_cache_name)
+
+    # "--lexicon FILE" can be passed anywhere among the arguments too
+    f_lexicon_name = None
+    if "--lexicon" in sys.argv:
+        i = sys.argv.index("--lexicon")
+        if i + 1 == len(sys.argv):
+            sys.exit("'--lexicon' expects the name of the lexicon file.")
+        f_lexicon_name = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+        cache.lexicon = Lexicon()
+        cache.lexicon.load(f_lexicon_name)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        if len(sys.argv) < 4:
+            sys.exit("Expected format: 'script-name --batch write-file-name"
+                     " read-file-or-directory-name...'.")
+        summaries = parse_batch(batch_read_names(sys.argv[3:]), sys.argv[2], cache)
+        for summary in summaries:
+            if summary.read_error is not None:
+                sys.stderr.write(summary.name + ": can't be read, "
+                                 + summary.read_error + "\n")
+                continue
+            sys.stderr.write("%s: %d items, %d cards, %d errors, %.3f s\n"
+                             % summary[:5])
+    else:
+        summaries = []
+        _parse_single(cache)
+
+    if f_cache_name is not None:
+        cache.save(f_cache_name)
+        sys.stderr.write("Render cache: " + str(cache.hits) + " hits, "
+                         + str(cache.misses) + " misses\n")
+    if f_lexicon_name is not None:
+        cache.lexicon.save(f_lexicon_name)
+    unreadable = sum(1 for summary in summaries if summary.read_error is not None)
+    if unreadable:
+        sys.exit(str(unreadable) + " of " + str(len(summaries)) + " files couldn't be read.")
+
+
+def _parse_single(cache):
     # these are default names, but they can be overridden by user input
     f_read_name = "C:/Users/juras/orgtd/newwords.org"
     f_write_name = "C:/Users/juras/orgtd/newflashcards.org"
@@ -482,25 +977,21 @@ def __main__():
                  " unprocessed words and one for writing processed flashcards."
                  " Expected format: 'script-name read-file-name write-file-name'."
                  " To use default files, pass 0 arguments.  To use default value"
-                 " for only one file, write '-' on place of that file's name.")
+                 " for only one file, write '-' on place of that file's name."
+                 " Pass '--cache cache-file-name' to keep rendered flashcards"
+                 " between runs, '--lexicon lexicon-file-name' to learn nouns and"
+                 " complete items that give only a noun, and '--profile"
+                 " report-name' to write a profile of the run.  To parse many"
+                 " files (or directories of .org files) at once, use"
+                 " 'script-name --batch write-file-name"
+                 " read-file-or-directory-name...'.")
     if len(sys.argv) == 3:
         if sys.argv[1] != '-':
             f_read_name = sys.argv[1]
         if sys.argv[2] != '-':
             f_write_name = sys.argv[2]
 
-    with ReadFileWrapper(open(f_read_name, 'r', encoding="utf-8")) as fwrap:
-        flashcards = deque()
-        for item in fwrap:
-            try:
-                flashcards.extend(parse_item(item).flashcard_lines)
-            except ItemFormatError as ex:
-                # TODO BETTER LOGGING
-                sys.stderr.write("Bad item format around line "
-                                 + str(fwrap.line_counter)
-                                 + ", message = "
-                                 + ex.message
-                                 + "\n")
+    (flashcards, _, _) = parse_file(f_read_name, cache)
 
     with open(f_write_name, 'a', encoding="utf-8") as f_write:
         # first line is header for file
@@ -510,6 +1001,10 @@ def __main__():
 
 
 if __name__ == '__main__':
-    __main__()
+    if "--profile" in sys.argv:
+        from profiling import profile_main
+        profile_main(__main__)
+    else:
+        __main__()
 
 # TODO update docstrings if you did any changes
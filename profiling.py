@@ -0,0 +1,172 @@
+import os
+import sys
+import ast
+import bisect
+import cProfile
+import pstats
+import threading
+import tracemalloc
+
+
+# the functions whose allocations are reported are those defined in this
+# directory, except in this module
+PROFILING_FILE = os.path.abspath(__file__)
+SOURCE_DIR = os.path.dirname(PROFILING_FILE)
+
+TOP_HOTSPOTS = 30
+TOP_ALLOCATIONS = 20
+TRACEBACK_DEPTH = 4     # deeper tracebacks make tracemalloc a lot slower
+SAMPLE_INTERVAL = 0.25  # seconds between checks of the traced memory
+SAMPLE_GROWTH = 1.5     # a new snapshot is taken only once memory grows this much
+
+
+class FunctionLocator:
+    """Finds the (qualified) name of the function that a line of a source file
+    belongs to: the innermost function whose definition spans the line.  Lines
+    outside of any function (e.g. of a class body) belong to '<module>'.
+    """
+
+    def __init__(self):
+        self._functions = {}  # file name -> (sorted first lines, last lines, names)
+
+    def _read_functions(self, file_name):
+        with open(file_name, 'r', encoding="utf-8") as file:
+            tree = ast.parse(file.read(), file_name)
+        functions = []
+
+        def visit(node, prefix):
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    functions.append((child.lineno, child.end_lineno, prefix + child.name))
+                    visit(child, prefix + child.name + ".")
+                elif isinstance(child, ast.ClassDef):
+                    visit(child, prefix + child.name + ".")
+
+        visit(tree, "")
+        functions.sort()
+        return ([first for first, _, _ in functions], [last for _, last, _ in functions],
+                [name for _, _, name in functions])
+
+    def locate(self, file_name, lineno):
+        """:return: 'module.function' for line 'lineno' of file 'file_name'"""
+        if file_name not in self._functions:
+            self._functions[file_name] = self._read_functions(file_name)
+        (first_lines, last_lines, names) = self._functions[file_name]
+        module = os.path.splitext(os.path.basename(file_name))[0]
+        # functions are nested or apart, so of the ones that start before the
+        # line, the innermost one that spans it is the last one that does
+        i = bisect.bisect_right(first_lines, lineno) - 1
+        while i >= 0:
+            if last_lines[i] >= lineno:
+                return module + "." + names[i]
+            i -= 1
+        return module + ".<module>"
+
+
+class PeakSampler(threading.Thread):
+    """Keeps a tracemalloc snapshot of (roughly) the moment the traced memory
+    was the highest, so that allocations freed before the end of the run are
+    reported too.  Taking a snapshot is expensive, so it is retaken only when
+    memory grew by SAMPLE_GROWTH since the last one.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.snapshot = None
+        self._size = -1
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def sample(self):
+        (size, _) = tracemalloc.get_traced_memory()
+        if size > self._size * SAMPLE_GROWTH:
+            self._size = size
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+def _own_frame(traceback):
+    """:return: the innermost frame of 'traceback' in our own source files, or None"""
+    for frame in reversed(traceback):  # tracemalloc keeps the innermost frame last
+        file_name = os.path.abspath(frame.filename)
+        if (file_name.endswith(".py") and file_name != PROFILING_FILE
+                and os.path.dirname(file_name) == SOURCE_DIR):
+            return frame
+    return None
+
+
+def write_allocation_report(snapshot, report):
+    """Writes the memory allocated in 'snapshot' per function of our own,
+    attributing allocations made by library code to the function of ours that
+    called it.
+    """
+    locator = FunctionLocator()
+    sizes = {}   # function name -> [size, count]
+    for statistic in snapshot.statistics('traceback'):
+        frame = _own_frame(statistic.traceback)
+        if frame is None:
+            continue
+        name = locator.locate(frame.filename, frame.lineno)
+        size = sizes.setdefault(name, [0, 0])
+        size[0] += statistic.size
+        size[1] += statistic.count
+
+    report.write("\nTop allocation sites at peak memory (own functions,"
+                 " including the library calls they make):\n")
+    by_size = sorted(sizes.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (size, count) in by_size[:TOP_ALLOCATIONS]:
+        report.write("%12.1f KiB %10d blocks  %s\n" % (size / 1024, count, name))
+
+
+def profile_main(main):
+    """Runs 'main' under cProfile and tracemalloc.  The name of the report is
+    taken from the '--profile report-name' option, which is removed from
+    sys.argv before 'main' is called.
+
+    The report 'report-name' lists the hotspots sorted by cumulative and own
+    time and the top allocation sites at the highest sampled memory use.  The
+    raw profile is dumped to 'report-name.pstats' so that runs can be compared
+    later with pstats.  Work done in other processes (e.g. in the batch mode of
+    parse_raw_phrases.py) is not profiled; forked processes stop profiling and
+    tracing allocations, so they aren't slowed down by them.
+    """
+    i = sys.argv.index("--profile")
+    if i + 1 == len(sys.argv):
+        sys.exit("'--profile' expects the name of the report file.")
+    report_name = sys.argv[i + 1]
+    del sys.argv[i:i + 2]
+
+    profiler = cProfile.Profile()
+    sampler = PeakSampler()
+
+    def stop_in_child():
+        profiler.disable()
+        tracemalloc.stop()
+
+    os.register_at_fork(after_in_child=stop_in_child)
+    tracemalloc.start(TRACEBACK_DEPTH)
+    sampler.start()
+    profiler.enable()
+    try:
+        main()
+    finally:
+        profiler.disable()
+        sampler.stop()
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(report_name + ".pstats")
+        with open(report_name, 'w', encoding="utf-8") as report:
+            stats = pstats.Stats(profiler, stream=report).strip_dirs()
+            report.write("Hotspots by cumulative time:\n")
+            stats.sort_stats('cumulative').print_stats(TOP_HOTSPOTS)
+            report.write("Hotspots by own time:\n")
+            stats.sort_stats('tottime').print_stats(TOP_HOTSPOTS)
+            report.write("Peak traced memory: %.1f KiB\n" % (peak / 1024))
+            write_allocation_report(sampler.snapshot, report)
@@ -0,0 +1,201 @@
+import sys
+import zipfile
+from re import compile
+from sqlite3 import Connection
+
+import numpy as np
+
+
+# how every column of the flashcards table is stored: as a NumPy array of the
+# given dtype, or as a string buffer (dtype None)
+COLUMNS = (('ID', None),
+           ('PWCENTRY', None),
+           ('FRONT', None),
+           ('BACK', None),
+           ('SCHEDULED', 'datetime64[D]'),
+           ('DRILL_LAST_INTERVAL', 'float64'),
+           ('DRILL_REPEATS_SINCE_FAIL', 'int64'),
+           ('DRILL_TOTAL_REPEATS', 'int64'),
+           ('DRILL_FAILURE_COUNT', 'int64'),
+           ('DRILL_AVERAGE_QUALITY', 'float64'),
+           ('DRILL_EASE', 'float64'),
+           ('DRILL_LAST_QUALITY', 'int64'),
+           ('DRILL_LAST_REVIEWED', 'datetime64[m]'))
+
+# values used instead of NULL; dates without a value become NaT
+MISSING = {'float64': np.nan, 'int64': -1}
+
+CHUNK_SIZE = 4096
+
+_date_re = compile("[<\\[]?(\\d{4}-\\d{2}-\\d{2})(?: \\w+)?(?: (\\d{2}:\\d{2}))?")
+
+
+def org_timestamp_to_iso(timestamp):
+    """Converts an org-mode timestamp to the ISO format NumPy understands.
+
+    >>> org_timestamp_to_iso("[2018-03-20 Tue 08:51]")
+    '2018-03-20T08:51'
+    >>> org_timestamp_to_iso("<2018-04-13 Fri>")
+    '2018-04-13'
+    >>> org_timestamp_to_iso(None)
+    'NaT'
+    """
+    m = _date_re.match(timestamp or '')
+    if m is None:
+        return 'NaT'
+    if m.group(2) is None:
+        return m.group(1)
+    return m.group(1) + "T" + m.group(2)
+
+
+class StringColumn:
+    """A column of strings kept as one buffer of UTF-8 bytes ('data') and the
+    offsets of the strings within it ('offsets', one longer than the column).
+    String i is data[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+def _iter_column(db_connection, column):
+    """Yields lists of at most CHUNK_SIZE values of 'column', in rowid order."""
+    cursor = db_connection.execute("SELECT " + column + " FROM flashcards ORDER BY rowid;")
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            return
+        yield [row[0] for row in rows]
+
+
+def _write_member(zfile, name, dtype, length, chunks):
+    """Writes a .npy member 'name' of 'length' elements into the open zip file
+    'zfile', one chunk of arrays at a time.
+    """
+    dtype = np.dtype(dtype)
+    with zfile.open(name + ".npy", 'w', force_zip64=True) as member:
+        np.lib.format.write_array_header_1_0(
+            member, {'descr': np.lib.format.dtype_to_descr(dtype),
+                     'fortran_order': False, 'shape': (length,)})
+        for chunk in chunks:
+            member.write(np.asarray(chunk, dtype=dtype).tobytes())
+
+
+def _numeric_chunks(db_connection, column, dtype):
+    missing = MISSING.get(dtype)
+    for values in _iter_column(db_connection, column):
+        if dtype.startswith('datetime64'):
+            # parsed with minute precision, because a date may have a time
+            values = np.array([org_timestamp_to_iso(value) for value in values],
+                              dtype='datetime64[m]')
+        else:
+            values = [missing if value is None else value for value in values]
+        yield np.asarray(values).astype(dtype)
+
+
+def _offset_chunks(db_connection, column):
+    end = 0
+    yield np.zeros(1, dtype='int64')
+    for values in _iter_column(db_connection, column):
+        lengths = [len((value or '').encode("utf-8")) for value in values]
+        offsets = end + np.cumsum(lengths, dtype='int64')
+        end = int(offsets[-1])
+        yield offsets
+
+
+def _data_chunks(db_connection, column):
+    for values in _iter_column(db_connection, column):
+        yield np.frombuffer("".join(value or '' for value in values).encode("utf-8"),
+                           dtype='uint8')
+
+
+def export_columns(db_connection, file_name):
+    """Writes the flashcards table into 'file_name' as an uncompressed .npz
+    file.  Every numeric and date column is one array, and every text column
+    is two arrays, '<column>_offsets' and '<column>_data' (see StringColumn).
+
+    The table is read column by column in chunks of CHUNK_SIZE rows, so memory
+    use doesn't depend on the size of the deck.
+    :param db_connection: sqlite3.Connection object instance, a database
+    :param file_name: name of the .npz file to write
+    """
+    db_connection.execute("BEGIN;")  # all columns are read from the same snapshot
+    try:
+        (length,) = db_connection.execute("SELECT COUNT(*) FROM flashcards;").fetchone()
+        with zipfile.ZipFile(file_name, 'w', zipfile.ZIP_STORED, allowZip64=True) as zfile:
+            for column, dtype in COLUMNS:
+                if dtype is not None:
+                    _write_member(zfile, column, dtype, length,
+                                  _numeric_chunks(db_connection, column, dtype))
+                    continue
+                (size,) = db_connection.execute(
+                    "SELECT TOTAL(LENGTH(CAST(" + column + " AS BLOB)))"
+                    " FROM flashcards;").fetchone()
+                _write_member(zfile, column + "_offsets", 'int64', length + 1,
+                              _offset_chunks(db_connection, column))
+                _write_member(zfile, column + "_data", 'uint8', int(size),
+                              _data_chunks(db_connection, column))
+    finally:
+        db_connection.rollback()
+
+
+def load_columns(file_name):
+    """Loads a file written by export_columns() by memory-mapping its arrays,
+    so reading them doesn't copy the data.  np.load() can read the file too,
+    but it doesn't memory-map .npz files.
+
+    :return: dict from column name to a read-only array or a StringColumn
+    """
+    arrays = {}
+    with open(file_name, 'rb') as file, zipfile.ZipFile(file) as zfile:
+        for info in zfile.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(info.filename + " in " + file_name + " is compressed")
+            # the local file header is 30 bytes followed by the file name and extra field
+            file.seek(info.header_offset + 26)
+            name_length = int.from_bytes(file.read(2), 'little')
+            extra_length = int.from_bytes(file.read(2), 'little')
+            file.seek(name_length + extra_length, 1)
+            if np.lib.format.read_magic(file) == (1, 0):
+                (shape, _, dtype) = np.lib.format.read_array_header_1_0(file)
+            else:
+                (shape, _, dtype) = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[:-len(".npy")]
+            if shape == (0,):  # an empty region can't be memory-mapped
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(file_name, dtype=dtype, mode='r',
+                                         offset=file.tell(), shape=shape)
+
+    columns = {}
+    for column, dtype in COLUMNS:
+        if dtype is None:
+            columns[column] = StringColumn(arrays[column + "_offsets"], arrays[column + "_data"])
+        else:
+            columns[column] = arrays[column]
+    return columns
+
+
+def __main__():
+    """Exports the flashcards table of a database (argument1) into a columnar
+    .npz file (argument2) for offline analytics.
+
+    """
+    if len(sys.argv) != 3:
+        sys.exit("This script expects names of 2 files -- the flashcards database"
+                 " and the .npz file to write the columns into."
+                 " Expected format: 'script-name database-name write-file-name'.")
+    db_connection = Connection(sys.argv[1])
+    export_columns(db_connection, sys.argv[2])
+    db_connection.close()
+
+
+if __name__ == '__main__':
+    __main__()
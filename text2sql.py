@@ -1,7 +1,12 @@
+import os
 import sys
+import asyncio
 import doctest
+from io import StringIO
+from bisect import bisect_left
 from collections import namedtuple
-from sqlite3 import Connection
+from datetime import date
+from sqlite3 import Connection, Error as SQLiteError
 from re import compile, match
 
 
@@ -12,15 +17,23 @@ class FileWrapper:
     instead of reading from a file directly.
 
     """
-    def __init__(self, file):
+    def __init__(self, file, linecounter=0):
+        """
+        :param file: a file in read mode
+        :param linecounter: number of lines that precede 'file', in case it is
+        only a part of a bigger file
+        """
         self.file = file
-        self._linecounter = 0
+        self._linecounter = linecounter
         self._currentline = None
         self.return_current_line = False
         # This is to be used in functions that read ahead of what they are supposed
         # to, in order to find the terminator of the text they are to work with.
         # In order for other functions to work normally, those read-ahead functions must
         # notify FileWrapper to "go back" one line.
+        self._recorded = None
+        # While not None, every freshly read line is also appended to this list,
+        # so that the raw text of a flashcard is available without re-reading it.
 
     def readline(self):
         """While reading a new line, it updates _linecounter and _currentline,
@@ -35,8 +48,31 @@ class FileWrapper:
         if self._currentline == '':
             raise OrgEOFError
         self._linecounter += 1
+        if self._recorded is not None:
+            self._recorded.append(self._currentline)
         return self._currentline
 
+    def start_recording(self, first_line=''):
+        """Starts remembering every line that is read from now on.
+
+        :param first_line: an already read line that should open the recording
+        """
+        self._recorded = [first_line]
+
+    def stop_recording(self):
+        """Stops remembering read lines.  A line that is to be returned again
+        (see return_current_line) is not part of the recording.
+
+        :return: string -- all the lines read since start_recording()
+        """
+        recorded = self._recorded
+        self._recorded = None
+        if recorded is None:
+            return ''
+        if self.return_current_line and len(recorded) > 1:
+            recorded.pop()
+        return "".join(recorded)
+
     def getlinecounter(self):
         return self._linecounter
 
@@ -94,6 +130,20 @@ def is_org_header(line):
             return False
 
 
+def org_header_depth(line):
+    """Returns the number of stars in front of an org header, or 0 if 'line'
+    is not an org header.
+
+    >>> org_header_depth("*** i1    :drill:")
+    3
+    >>> org_header_depth("prevara, obmana")
+    0
+    """
+    if not is_org_header(line):
+        return 0
+    return len(line) - len(line.lstrip('*'))
+
+
 def is_drill_header(line):
     """Checks if line is a drill header.
 
@@ -132,7 +182,8 @@ def extract_properties(filewrp):
                 return Properties(scheduled, id, dli, drsf, dtr, dfc, daq,
                               de, dlq, dlr)
             except NameError:
-                raise OrgLineFormatError("A property that should have been defined wasn't defined.")
+                raise OrgLineFormatError(filewrp, "A property that should have"
+                                         " been defined wasn't defined.")
         elif line == '':
             continue
         elif line.startswith("SCHEDULED:"):
@@ -145,31 +196,35 @@ def extract_properties(filewrp):
 
         m = lineformat_re.match(line)
         if not m:
-            raise OrgLineFormatError("Line doesn't contain org-mode property.")
+            raise OrgLineFormatError(filewrp, "Line doesn't contain org-mode property.")
 
         name = m.group(1)
         value = m.group(2).strip()
 
-        if name == "ID":
-            id = value
-        elif name == "DRILL_LAST_INTERVAL":
-            dli = float(value)
-        elif name == "DRILL_REPEATS_SINCE_FAIL":
-            drsf = int(value)
-        elif name == "DRILL_TOTAL_REPEATS":
-            dtr = int(value)
-        elif name == "DRILL_FAILURE_COUNT":
-            dfc = int(value)
-        elif name == "DRILL_AVERAGE_QUALITY":
-            daq = float(value)
-        elif name == "DRILL_EASE":
-            de = float(value)
-        elif name == "DRILL_LAST_QUALITY":
-            dlq = int(value)
-        elif name == "DRILL_LAST_REVIEWED":
-            dlr = value
-        else:
-            raise OrgLineFormatError(filewrp, "Unexpected property " + name)
+        try:
+            if name == "ID":
+                id = value
+            elif name == "DRILL_LAST_INTERVAL":
+                dli = float(value)
+            elif name == "DRILL_REPEATS_SINCE_FAIL":
+                drsf = int(value)
+            elif name == "DRILL_TOTAL_REPEATS":
+                dtr = int(value)
+            elif name == "DRILL_FAILURE_COUNT":
+                dfc = int(value)
+            elif name == "DRILL_AVERAGE_QUALITY":
+                daq = float(value)
+            elif name == "DRILL_EASE":
+                de = float(value)
+            elif name == "DRILL_LAST_QUALITY":
+                dlq = int(value)
+            elif name == "DRILL_LAST_REVIEWED":
+                dlr = value
+            else:
+                raise OrgLineFormatError(filewrp, "Unexpected property " + name)
+        except ValueError:
+            raise OrgLineFormatError(filewrp, "Value of property " + name
+                                     + " is not a number")
 
 
 def extract_flashcard(filewrp, pwce_name):
@@ -225,41 +280,253 @@ def extract_pwce_name(line):
     return pwce_name
 
 
+INSERT_FLASHCARD_SQL = """INSERT INTO flashcards VALUES (
+             :ID, :PWCENTRY, :FRONT, :BACK, :SCHEDULED, :DRILL_LAST_INTERVAL,
+             :DRILL_REPEATS_SINCE_FAIL, :DRILL_TOTAL_REPEATS,
+             :DRILL_FAILURE_COUNT, :DRILL_AVERAGE_QUALITY,
+             :DRILL_EASE, :DRILL_LAST_QUALITY, :DRILL_LAST_REVIEWED
+          );"""
+
+
 def insert_flashcard_into_db(flashcard: Flashcard, db_connection: Connection):
     """
     Inserts a single flashcard into the database.
     :param flashcard: Flashcard object instance
     :param db_connection: sqlite3.Connection object instance, a database
     """
-    sql = """INSERT INTO flashcards VALUES (
-             :ID, :PWCENTRY, :FRONT, :BACK, :SCHEDULED, :DRILL_LAST_INTERVAL,
-             :DRILL_REPEATS_SINCE_FAIL, :DRILL_TOTAL_REPEATS,
-             :DRILL_FAILURE_COUNT, :DRILL_AVERAGE_QUALITY,
-             :DRILL_EASE, :DRILL_LAST_QUALITY, :DRILL_LAST_REVIEWED
-          );"""
+    db_connection.execute(INSERT_FLASHCARD_SQL, flashcard._asdict())
+
+
+# one review of a flashcard, noticed as a change of its review properties between imports
+ReviewEvent = namedtuple("ReviewEvent", ('ID', 'PWCENTRY', 'DAY', 'WEEK', 'QUALITY',
+                                         'TOTAL_REPEATS', 'FAILED', 'LAST_REVIEWED'))
+
+REVIEW_BATCH_SIZE = 500
+
+
+def create_review_tables(db_connection: Connection):
+    """Creates (if they don't exist yet) the append-only review log and its
+    daily and weekly rollups per PWCEntry.
+    :param db_connection: sqlite3.Connection object instance, a database
+    """
+    db_connection.execute("""CREATE TABLE IF NOT EXISTS review_log (
+                             ID TEXT, PWCENTRY TEXT, DAY TEXT, WEEK TEXT,
+                             QUALITY INTEGER, TOTAL_REPEATS INTEGER,
+                             FAILED INTEGER, LAST_REVIEWED TEXT
+                          );""")
+    for table, period in (("review_daily", "DAY"), ("review_weekly", "WEEK")):
+        db_connection.execute("CREATE TABLE IF NOT EXISTS " + table + " ("
+                              + period + """ TEXT, PWCENTRY TEXT,
+                              REVIEWS INTEGER, QUALITY_SUM INTEGER,
+                              AVERAGE_QUALITY REAL, FAILURES INTEGER,
+                              PRIMARY KEY (""" + period + """, PWCENTRY)
+                          );""")
+
+
+def review_day(last_reviewed):
+    """Returns the date of a DRILL_LAST_REVIEWED value, or today if it has no date.
+
+    >>> review_day("[2018-03-20 Tue 08:51]")
+    datetime.date(2018, 3, 20)
+    """
+    m = compile("\\[?(\\d{4})-(\\d{2})-(\\d{2})").match(last_reviewed or '')
+    if m is None:
+        return date.today()
+    return date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+
+
+def find_review_events(flashcards, db_connection):
+    """Compares 'flashcards' with the stored flashcards of the same IDs and
+    returns a ReviewEvent for every flashcard whose DRILL_LAST_QUALITY,
+    DRILL_LAST_REVIEWED or DRILL_TOTAL_REPEATS changed.  Flashcards that
+    aren't stored yet have no history to compare with.
+    :param flashcards: list of Flashcard object instances
+    :param db_connection: sqlite3.Connection object instance, a database
+    """
+    stored = {}
+    sql = ("SELECT ID, DRILL_LAST_QUALITY, DRILL_LAST_REVIEWED, DRILL_TOTAL_REPEATS,"
+           " DRILL_FAILURE_COUNT FROM flashcards WHERE ID IN ("
+           + ", ".join("?" * len(flashcards)) + ");")
+    for row in db_connection.execute(sql, [flashcard.ID for flashcard in flashcards]):
+        stored[row[0]] = row[1:]
+
+    events = []
+    for flashcard in flashcards:
+        old = stored.get(flashcard.ID)
+        if old is None or old[:3] == (flashcard.DRILL_LAST_QUALITY,
+                                      flashcard.DRILL_LAST_REVIEWED,
+                                      flashcard.DRILL_TOTAL_REPEATS):
+            continue
+        day = review_day(flashcard.DRILL_LAST_REVIEWED)
+        (year, week, _) = day.isocalendar()
+        events.append(ReviewEvent(ID=flashcard.ID,
+                                  PWCENTRY=flashcard.PWCENTRY,
+                                  DAY=day.isoformat(),
+                                  WEEK="%04d-W%02d" % (year, week),
+                                  QUALITY=flashcard.DRILL_LAST_QUALITY,
+                                  TOTAL_REPEATS=flashcard.DRILL_TOTAL_REPEATS,
+                                  FAILED=int(flashcard.DRILL_FAILURE_COUNT > (old[3] or 0)),
+                                  LAST_REVIEWED=flashcard.DRILL_LAST_REVIEWED))
+    return events
+
+
+def update_review_rollups(events, db_connection):
+    """Adds 'events' to the daily and weekly rollups, so that the review log
+    never has to be scanned to get them.
+    :param events: list of ReviewEvent object instances
+    :param db_connection: sqlite3.Connection object instance, a database
+    """
+    for table, period in (("review_daily", "DAY"), ("review_weekly", "WEEK")):
+        totals = {}  # (period, PWCENTRY) -> [reviews, quality sum, failures]
+        for event in events:
+            total = totals.setdefault((getattr(event, period), event.PWCENTRY), [0, 0, 0])
+            total[0] += 1
+            total[1] += event.QUALITY
+            total[2] += event.FAILED
+        db_connection.executemany("INSERT OR IGNORE INTO " + table
+                                  + " VALUES (?, ?, 0, 0, 0, 0);", totals.keys())
+        db_connection.executemany("UPDATE " + table + """ SET
+                                     REVIEWS = REVIEWS + ?,
+                                     QUALITY_SUM = QUALITY_SUM + ?,
+                                     AVERAGE_QUALITY = (QUALITY_SUM + ?) * 1.0 / (REVIEWS + ?),
+                                     FAILURES = FAILURES + ?
+                                  WHERE """ + period + " = ? AND PWCENTRY = ?;",
+                                  [(reviews, quality, quality, reviews, failures) + key
+                                   for key, (reviews, quality, failures) in totals.items()])
+
+
+def save_flashcards(flashcards, db_connection):
+    """Saves a batch of flashcards in a single transaction, replacing stored
+    flashcards with the same IDs.  Changes of review properties are appended to
+    the review log and its rollups beforehand.
+    :param flashcards: list of Flashcard object instances
+    :param db_connection: sqlite3.Connection object instance, a database
+    """
+    if not flashcards:
+        return
+    events = find_review_events(flashcards, db_connection)
+    if events:
+        db_connection.executemany("INSERT INTO review_log VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                                  events)
+        update_review_rollups(events, db_connection)
+    db_connection.executemany("DELETE FROM flashcards WHERE ID = ?;",
+                              [(flashcard.ID,) for flashcard in flashcards])
+    db_connection.executemany(INSERT_FLASHCARD_SQL,
+                              [flashcard._asdict() for flashcard in flashcards])
+    db_connection.commit()
+
+
+ImportSummary = namedtuple("ImportSummary", ('imported', 'quarantined'))
+
+
+def create_quarantine_table(db_connection: Connection):
+    """Creates (if it doesn't exist yet) the table in which flashcards that
+    couldn't be parsed are kept, together with the place they were found at.
+    :param db_connection: sqlite3.Connection object instance, a database
+    """
+    db_connection.execute("""CREATE TABLE IF NOT EXISTS quarantine (
+                             SOURCE TEXT, LINE INTEGER, MESSAGE TEXT, RAW TEXT
+                          );""")
+
+
+def create_watched_table(db_connection: Connection):
+    """Creates (if it doesn't exist yet) the table of the flashcard IDs that
+    the watched files (see DeckWatcher) held when they were last synced.
+    :param db_connection: sqlite3.Connection object instance, a database
+    """
+    db_connection.execute("""CREATE TABLE IF NOT EXISTS watched_flashcards (
+                             SOURCE TEXT, ID TEXT, PRIMARY KEY (SOURCE, ID)
+                          );""")
+
+
+def skip_to_next_entry(filewrp, depth, card_line):
+    """Reads forward until an org header of depth 'depth' or less is found and
+    notifies filewrp to return that header on the next readline(), so that
+    parsing can continue from there.  Lines of the broken flashcard are skipped
+    in the process.  The current line is checked first, since the error may have
+    been noticed on the header of the next entry (e.g. a drawer that was cut off).
+    :param filewrp: FileWrapper positioned somewhere within a flashcard
+    :param depth: depth of the drill header of the flashcard being skipped
+    :param card_line: line number of that drill header
+    """
+    if (filewrp.getlinecounter() > card_line
+            and 0 < org_header_depth(filewrp._currentline) <= depth):
+        filewrp.return_current_line = True
+        return
+    while True:
+        try:
+            line = filewrp.readline()
+        except OrgEOFError:
+            return
+        if 0 < org_header_depth(line) <= depth:
+            filewrp.return_current_line = True
+            return
+
 
-    db_connection.execute(sql, flashcard._asdict())
+def clear_quarantine(db_connection, source):
+    """Deletes the quarantined flashcards of file 'source', so that the
+    quarantine table only holds flashcards that are still broken.
+    :param db_connection: sqlite3.Connection object instance, a database
+    """
+    db_connection.execute("DELETE FROM quarantine WHERE SOURCE IS ?;", (source,))
 
 
-def read_and_save_flashcards(filewrp, db_connection):
+def read_and_save_flashcards(filewrp, db_connection, robust=False, replace_quarantined=True):
     """Reads an org-mode file and parses Flashcard objects from org-drill style
-    flashcards, and writes it to a database in parallel.
+    flashcards, and writes it to a database in parallel.  Flashcards are saved
+    in batches (see save_flashcards()).
+
+    In robust mode a malformed flashcard doesn't make the parser lose its place:
+    the rest of it is skipped up to the next entry, and its raw text and line number
+    are stored in the quarantine table instead of only being reported.
     :param filewrp: FileWrapper over file from which Flashcard instances are parsed
     :param db_connection: sqlite3.Connection instance to the database for storing flashcards
+    :param robust: whether to resynchronize and quarantine malformed flashcards
+    :param replace_quarantined: whether the flashcards quarantined earlier for the
+    same file are deleted first (see clear_quarantine())
+    :return: ImportSummary with the numbers of imported and quarantined flashcards
     """
+    source = getattr(filewrp.file, 'name', None)
+    if robust:
+        create_quarantine_table(db_connection)
+        if replace_quarantined:
+            clear_quarantine(db_connection, source)
+    create_review_tables(db_connection)
+    imported = 0
+    batch = []
+    quarantined = []
     pwce_name = None
     while True:
+        depth = 0
         try:
             line = filewrp.readline()  # Raises ORGEOFError when file is finished
+            card_line = filewrp.getlinecounter()
             if is_drill_header(line):
+                depth = org_header_depth(line)
+                if robust:
+                    filewrp.start_recording(line)
                 if pwce_name is None:
                     raise OrgLineFormatError(filewrp,
                                              "pwce_name is None but should"
                                              " have been set. Skipping flashcard")
-                flashcard = extract_flashcard(filewrp, pwce_name)
-                insert_flashcard_into_db(flashcard, db_connection)
+                try:
+                    flashcard = extract_flashcard(filewrp, pwce_name)
+                except OrgEOFError:
+                    raise OrgLineFormatError(filewrp, "File ended in the middle"
+                                             " of a flashcard")
+                filewrp.stop_recording()
+                batch.append(flashcard)
+                imported += 1
+                if len(batch) == REVIEW_BATCH_SIZE:
+                    save_flashcards(batch, db_connection)
+                    batch = []
             elif is_org_header(line):
-                pwce_name = extract_pwce_name(line)
+                try:
+                    pwce_name = extract_pwce_name(line)
+                except AttributeError:
+                    pwce_name = None
+                    raise OrgLineFormatError(filewrp, "Header doesn't contain"
+                                             " a PWCEntry name")
                 # filewrp.readline()
             else:
                 # Empty line, a comment, or an error happened in the middle of parsing
@@ -267,13 +534,205 @@ def read_and_save_flashcards(filewrp, db_connection):
                 continue
         except OrgLineFormatError as exc:
             # TODO DO BETTER LOGGING
-            sys.stderr.write("OrgLineFormatError at line",
-                             str(exc.linecounter),
-                             ": '", exc.message, "'. line = '",
-                             exc.currentline, "'\n")
+            sys.stderr.write("OrgLineFormatError at line "
+                             + str(exc.linecounter)
+                             + ": '" + exc.message + "'. line = '"
+                             + str(exc.currentline).rstrip("\n") + "'\n")
+            if robust:
+                if depth:
+                    skip_to_next_entry(filewrp, depth, card_line)
+                raw = filewrp.stop_recording() or exc.currentline
+                quarantined.append((source, card_line, exc.message, raw))
         except OrgEOFError:
             break
+    save_flashcards(batch, db_connection)
+    if quarantined:
+        db_connection.executemany("INSERT INTO quarantine VALUES (?, ?, ?, ?);",
+                                  quarantined)
     db_connection.commit()
+    return ImportSummary(imported, len(quarantined))
+
+
+def split_entries(text):
+    """Splits the text of an org file into parts that each start with the
+    header of a PWCEntry and contain its flashcards, so that every part can be
+    parsed on its own.  Whatever precedes the first such header is a part of its own.
+
+    >>> split_entries("* a\\n** b\\n*** q :drill:\\nfoo\\n**** a\\nbar\\n** c\\n")
+    [(0, '* a\\n'), (1, '** b\\n*** q :drill:\\nfoo\\n**** a\\nbar\\n'), (6, '** c\\n')]
+
+    :return: list of (number of lines preceding the part, text of the part)
+    """
+    entries = []
+    lines = []
+    first = 0
+    in_drill = False  # whether the next header is the backside of a flashcard
+    for number, line in enumerate(text.splitlines(True)):
+        if is_drill_header(line):
+            in_drill = True
+        elif is_org_header(line):
+            if in_drill:
+                in_drill = False
+            elif lines:
+                entries.append((first, "".join(lines)))
+                lines = []
+                first = number
+        lines.append(line)
+    if lines:
+        entries.append((first, "".join(lines)))
+    return entries
+
+
+class DeckWatcher:
+    """Keeps the flashcards database in sync with a set of org files.
+
+    The files are polled for changes of their modification time and size.  Once
+    a changed file has been left alone for 'debounce' seconds, only the entries
+    (see split_entries()) whose text has changed are imported again, and flashcards
+    of removed entries are deleted.  The IDs every file holds are kept in the
+    watched_flashcards table, so flashcards of entries removed while the files
+    weren't watched are deleted too, on the first sync of their file.  Files
+    are known by the name they are watched under.  Malformed flashcards are
+    quarantined.  If syncing a file fails (e.g. it is in the middle of being
+    saved), the error is reported and the file is synced again on a later poll.
+
+    All the database work is done on a single connection from within the event
+    loop, one entry at a time, so query() calls made by other coroutines
+    are served between entries instead of waiting for a whole file.
+    """
+
+    def __init__(self, file_names, db_connection, poll_interval=0.25, debounce=0.3):
+        self.file_names = list(file_names)
+        self.db_connection = db_connection
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._stats = {}       # file name -> (mtime, size) when last polled
+        self._pending = {}     # file name -> loop time of the latest change
+        self._entries = {}     # file name -> {first line: (entry text, IDs in it)}
+        self._id_re = compile("^[ \t]*:ID:[ \t]*(\\S+)")
+
+    async def query(self, sql, parameters=()):
+        """Executes 'sql' on the watched database.
+
+        :return: list of result rows
+        """
+        return self.db_connection.execute(sql, parameters).fetchall()
+
+    async def run(self):
+        """Polls the files forever."""
+        loop = asyncio.get_running_loop()
+        while True:
+            for file_name in self.file_names:
+                try:
+                    stat = os.stat(file_name)
+                except FileNotFoundError:
+                    continue
+                stat = (stat.st_mtime_ns, stat.st_size)
+                if stat != self._stats.get(file_name):
+                    self._stats[file_name] = stat
+                    self._pending[file_name] = loop.time()
+                elif (file_name in self._pending
+                      and loop.time() - self._pending[file_name] >= self.debounce):
+                    del self._pending[file_name]
+                    try:
+                        await self.sync_file(file_name)
+                    except (OSError, UnicodeDecodeError, SQLiteError) as exc:
+                        # e.g. the file is being saved; forget its stat so that
+                        # it is synced again once it changes or the next poll comes
+                        self.db_connection.rollback()
+                        self._stats.pop(file_name, None)
+                        sys.stderr.write("Syncing " + file_name + " failed: "
+                                         + repr(exc) + "\n")
+            await asyncio.sleep(self.poll_interval)
+
+    def _ids(self, entry):
+        return [m.group(1) for m in map(self._id_re.match, entry.splitlines())
+                if m is not None]
+
+    def _delete_flashcards(self, ids):
+        self.db_connection.executemany("DELETE FROM flashcards WHERE ID = ?;",
+                                       [(id,) for id in ids])
+
+    def _move_quarantined(self, file_name, old_entries, kept):
+        """Moves the quarantined flashcards of the entries that were kept to the
+        lines they are at now, and deletes those of the other entries, which are
+        imported again.  The line numbers of the rows are those of the entries
+        as they were when they were last imported.
+        :param old_entries: dict from first line to (entry text, IDs) of the
+        entries of the file that were imported
+        :param kept: dict from the first line of a kept entry in 'old_entries'
+        to its first line now
+        """
+        firsts = sorted(old_entries)
+        moved = []
+        removed = []
+        for rowid, line in self.db_connection.execute(
+                "SELECT rowid, LINE FROM quarantine WHERE SOURCE IS ?;", (file_name,)):
+            # the lines of an entry are the ones after its first line
+            i = bisect_left(firsts, line) - 1
+            first = firsts[i] if i >= 0 else None
+            if (first in kept
+                    and line <= first + len(old_entries[first][0].splitlines())):
+                moved.append((line - first + kept[first], rowid))
+            else:
+                removed.append((rowid,))
+        self.db_connection.executemany("UPDATE quarantine SET LINE = ? WHERE rowid = ?;",
+                                       moved)
+        self.db_connection.executemany("DELETE FROM quarantine WHERE rowid = ?;", removed)
+
+    async def sync_file(self, file_name):
+        """Imports the entries of 'file_name' that changed since the last
+        call and deletes the flashcards of entries that are gone.
+        """
+        create_quarantine_table(self.db_connection)
+        create_watched_table(self.db_connection)
+        with open(file_name, 'r', encoding="utf-8") as file:
+            text = file.read()
+        old_entries = self._entries.get(file_name, {})
+        unchanged = {}  # entry text -> [first line in old_entries]
+        for first in sorted(old_entries):
+            unchanged.setdefault(old_entries[first][0], []).append(first)
+        new_entries = {}
+        kept = {}
+        changed = []
+        for first, entry in split_entries(text):
+            if unchanged.get(entry):
+                old_first = unchanged[entry].pop(0)
+                kept[old_first] = first
+                new_entries[first] = old_entries[old_first]
+            else:
+                changed.append((first, entry, self._ids(entry)))
+
+        # flashcards of changed entries are replaced by ID when they are saved,
+        # so that changes of their review properties are noticed.  A flashcard
+        # may have moved to another watched file, so only the IDs that no other
+        # file held when it was last synced are gone.
+        held = set(id for _, ids in new_entries.values() for id in ids)
+        held.update(id for _, _, ids in changed for id in ids)
+        gone = set(id for (id,) in self.db_connection.execute(
+            """SELECT ID FROM watched_flashcards WHERE SOURCE IS ? AND ID NOT IN (
+                   SELECT ID FROM watched_flashcards WHERE SOURCE IS NOT ?
+               );""", (file_name, file_name)))
+        gone.difference_update(held)
+        self._delete_flashcards(gone)
+        self.db_connection.execute("DELETE FROM watched_flashcards WHERE SOURCE IS ?;",
+                                   (file_name,))
+        self.db_connection.executemany("INSERT OR IGNORE INTO watched_flashcards"
+                                       " VALUES (?, ?);", [(file_name, id) for id in held])
+        self._move_quarantined(file_name, old_entries, kept)
+        self.db_connection.commit()
+
+        # from now on the quarantine table holds the lines of the new text, so an
+        # entry is remembered only once it is imported; if syncing fails, the
+        # entries that weren't imported yet are imported on the next sync
+        self._entries[file_name] = new_entries
+        for first, entry, ids in changed:
+            entry_file = StringIO(entry)
+            entry_file.name = file_name
+            read_and_save_flashcards(FileWrapper(entry_file, first), self.db_connection,
+                                     robust=True, replace_quarantined=False)
+            new_entries[first] = (entry, ids)
+            await asyncio.sleep(0)  # let queries through between entries
 
 
 def __main__():
@@ -283,6 +742,23 @@ def __main__():
     :return:
     """
 
+    # "--robust" can be passed anywhere among the arguments
+    robust = "--robust" in sys.argv
+    if robust:
+        sys.argv.remove("--robust")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--watch":
+        if len(sys.argv) < 4:
+            sys.exit("Expected format: 'script-name --watch database-name"
+                     " read-file-name...'.")
+        db_connection = Connection(sys.argv[2])
+        watcher = DeckWatcher(sys.argv[3:], db_connection)
+        try:
+            asyncio.run(watcher.run())
+        except KeyboardInterrupt:
+            db_connection.close()
+        return
+
     readfile_name = "C:/Users/juras/PycharmProjects/elkoi_py/worte_excerpt.org"
     # writefile_name = "C:/Users/juras/PycharmProjects/elkoi_py/parsed-worte_excerpt.org"
     database_name = "C:/Users/juras/elkoi/db/test.db"
@@ -293,7 +769,12 @@ def __main__():
                  # TODO writing file will have different purpse
                  " Expected format: 'script-name read-file-name database-name'."
                  " To use default files, pass 0 arguments.  To use default value"
-                 " for only one file, write '-' on place of that file's name.")
+                 " for only one file, write '-' on place of that file's name."
+                 " Pass '--robust' to skip malformed flashcards and keep them"
+                 " in the quarantine table, and '--profile report-name' to write"
+                 " a profile of the run.  To keep the database in sync with"
+                 " org files, use 'script-name --watch database-name"
+                 " read-file-name...'.")
     if len(sys.argv) == 3:
         if sys.argv[1] != '-':
             readfile_name = sys.argv[1]
@@ -305,10 +786,17 @@ def __main__():
 
     filewrp = FileWrapper(open(readfile_name, 'r', encoding="utf-8"))
     db_connection = Connection(database_name)
-    read_and_save_flashcards(filewrp, db_connection)
+    summary = read_and_save_flashcards(filewrp, db_connection, robust)
+    if robust:
+        sys.stderr.write("Imported " + str(summary.imported) + " flashcards, "
+                         + str(summary.quarantined) + " quarantined.\n")
 
 
 if __name__ == "__main__":
-    __main__()
+    if "--profile" in sys.argv:
+        from profiling import profile_main
+        profile_main(__main__)
+    else:
+        __main__()
 
 # TODO update docstrings if you did any changes